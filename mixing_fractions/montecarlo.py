@@ -1,4 +1,8 @@
 import numpy as np
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from numba import njit, guvectorize
+from mixing_fractions.utils import _fastmath
 
 def MC_integral(target, samples):
     """
@@ -7,6 +11,7 @@ def MC_integral(target, samples):
     
     target [p(x)] must have a pdf() method
     Lists of targets are also accepted.
+    The average is computed in log-space, using logpdf() if available.
     
     Arguments:
         list or class instance target: the probability density to evaluate. Must have a pdf() method.
@@ -16,24 +21,211 @@ def MC_integral(target, samples):
         double: integral value
     """
     # Check that target is iterable or callable:
-    if not ((hasattr(target, 'pdf') or np.iterable(target)):
+    if not (hasattr(target, 'pdf') or np.iterable(target)):
         raise Exception("target must be list of callables or have pdf method")
     # Number of p draws and methods check
     if np.iterable(target):
         if not np.all([hasattr(pi, 'pdf') for pi in target]):
             raise Exception("target must have pdf method")
         n_p = len(target)
-        np.random.shuffle(target)
         iter_target = True
     else:
         if not hasattr(target, 'pdf'):
             raise Exception("p must have pdf method")
         iter_target = False
     # Integrals
-    if iter_target:
-        probabilities = np.array([pi.pdf(samples) for pi in target])
-    else:
-        probabilities = np.atleast_2d(target.pdf(samples))
-    means = probabilities.mean(axis = 1)
-    I = means.mean()
-    return np.log(I)
+    if not iter_target:
+        target = [target]
+    return _mc_integral_fast(target, samples)
+
+def _mc_integral_fast(target, samples):
+    """
+    Monte Carlo integration as in MC_integral, without input checks.
+    
+    Arguments:
+        list target:        the probability densities to evaluate. Each must have a pdf() method.
+        np.ndarray samples: posterior samples already drawn from q(x)
+    
+    Return:
+        double: log integral value
+    """
+    log_probabilities = np.array([_model_logpdf(pi, samples) for pi in target])
+    return _log_mc(np.ascontiguousarray(log_probabilities, dtype = np.float64))
+
+def _mc_integral_batched(models, all_samples, offsets, verbose = True):
+    """
+    Monte Carlo integration for several events at once.
+    The posterior samples of all the events are concatenated, so that each model pdf() is called only once.
+    Models without a compiled evaluation are evaluated concurrently by a pool of threads, as their pdf() methods usually release the GIL.
+    As in MC_integral, a model can also be a list of probability densities (e.g. several draws for the same channel): the integral is averaged over the list.
+    
+    Arguments:
+        iterable models:        the probability densities to evaluate. Each must have a pdf() method or be a list of objects with a pdf() method.
+        np.ndarray all_samples: concatenated posterior samples of all the events
+        np.ndarray offsets:     index of the first sample of each event, followed by the total number of samples
+        bool verbose:           whether to display a progress bar
+    
+    Return:
+        np.ndarray: log integral values, shape (n_events, n_models)
+    """
+    points  = all_samples.reshape(len(all_samples), -1)
+    # One entry per single probability density, labelled by model
+    draws   = [(j, pi) for j, model in enumerate(models) for pi in ([model] if hasattr(model, 'pdf') else model)]
+    log_I_d = np.empty((len(draws), len(offsets) - 1))
+    with ThreadPoolExecutor() as executor, tqdm(total = len(draws), desc = 'Evaluating probabilities', disable = not verbose) as progress:
+        # Threaded draws are submitted first, so that they run while the gufunc evaluates the Gaussian mixtures
+        futures = {executor.submit(lambda pi: _log_mc_segments(_model_logpdf(pi, all_samples), offsets), pi): k for k, (_, pi) in enumerate(draws) if not _is_gaussian_mixture(pi)}
+        # The gufunc is already parallel
+        for k, (_, pi) in enumerate(draws):
+            if _is_gaussian_mixture(pi):
+                log_I_d[k] = _log_mc_segments(_gaussian_mixture_logpdf(points, *_pack_gaussian_mixture(pi)), offsets)
+                progress.update()
+        for future in as_completed(futures):
+            log_I_d[futures[future]] = future.result()
+            progress.update()
+    # Average over the draws of each model
+    labels = np.array([j for j, _ in draws])
+    log_I  = np.empty((len(offsets) - 1, len(models)))
+    for j in range(len(models)):
+        log_I[:,j] = _log_mean_exp(log_I_d[labels == j])
+    return log_I
+
+def _log_mean_exp(log_values):
+    """
+    Log of the mean of exp(log_values) along the first axis, computed in log-space.
+    
+    Arguments:
+        np.ndarray log_values: log values, shape (n_draws, n_events)
+    
+    Return:
+        np.ndarray: log mean values, shape (n_events,)
+    """
+    log_max = np.max(log_values, axis = 0)
+    log_max = np.where(np.isfinite(log_max), log_max, 0.)
+    with np.errstate(divide = 'ignore'):
+        return np.log(np.mean(np.exp(log_values - log_max), axis = 0)) + log_max
+
+def _log_mc_segments(log_probabilities, offsets):
+    """
+    Log of the mean of exp(log_probabilities) for each event, computed in log-space.
+    
+    Arguments:
+        np.ndarray log_probabilities: log-pdf values for the concatenated samples
+        np.ndarray offsets:           index of the first sample of each event, followed by the total number of samples
+    
+    Return:
+        np.ndarray: log integral values, shape (n_events,)
+    """
+    starts    = offsets[:-1]
+    n_samples = np.diff(offsets)
+    log_max   = np.maximum.reduceat(log_probabilities, starts)
+    log_max   = np.where(np.isfinite(log_max), log_max, 0.)
+    with np.errstate(divide = 'ignore'):
+        return np.log(np.add.reduceat(np.exp(log_probabilities - np.repeat(log_max, n_samples)), starts)/n_samples) + log_max
+
+def _model_logpdf(model, samples):
+    """
+    Evaluate the log-pdf of a model, using its logpdf() method if available.
+    
+    Arguments:
+        class instance model: the probability density. Must have a pdf() method.
+        np.ndarray samples:   samples to evaluate the model at
+    
+    Return:
+        np.ndarray: log-pdf values
+    """
+    if hasattr(model, 'logpdf'):
+        return model.logpdf(samples)
+    with np.errstate(divide = 'ignore'):
+        return np.log(model.pdf(samples))
+
+@njit(cache = True, fastmath = _fastmath)
+def _log_mc(logp):
+    """
+    Log of the mean of exp(logp), computed in log-space.
+    
+    Arguments:
+        np.ndarray logp: log-pdf values, shape (n_models, n_samples)
+    
+    Return:
+        double: log integral value
+    """
+    M, N = logp.shape
+    mx   = -np.inf
+    for m in range(M):
+        for n in range(N):
+            if logp[m, n] > mx:
+                mx = logp[m, n]
+    if mx == -np.inf:
+        return -np.inf
+    s = 0.
+    for m in range(M):
+        for n in range(N):
+            s += np.exp(logp[m, n] - mx)
+    return np.log(s/(M*N)) + mx
+
+def _is_gaussian_mixture(model):
+    """
+    Check whether the model exposes the parameters of a Gaussian mixture (means, covs and w attributes, as figaro mixtures do) without a probit transformation.
+    
+    Arguments:
+        class instance model: the probability density
+    
+    Return:
+        bool: whether the model can be evaluated with _gaussian_mixture_logpdf
+    """
+    return all([hasattr(model, attr) for attr in ['means', 'covs', 'w']]) and not getattr(model, 'probit', False)
+
+def _pack_gaussian_mixture(model):
+    """
+    Pack the parameters of a Gaussian mixture into contiguous arrays.
+    
+    Arguments:
+        class instance model: Gaussian mixture with means, covs and w attributes
+    
+    Return:
+        np.ndarray means:     component means, shape (n_components, dim)
+        np.ndarray inv_chols: inverse Cholesky factors of the covariances, shape (n_components, dim, dim)
+        np.ndarray log_norms: log-weights plus log-normalisation constants, shape (n_components,)
+    """
+    w         = np.asarray(model.w, dtype = np.float64).flatten()
+    keep      = w > 0
+    means     = np.asarray(model.means, dtype = np.float64).reshape(len(w), -1)[keep]
+    dim       = means.shape[-1]
+    covs      = np.asarray(model.covs, dtype = np.float64).reshape(len(w), dim, dim)[keep]
+    chols     = np.linalg.cholesky(covs)
+    inv_chols = np.ascontiguousarray(np.linalg.inv(chols))
+    log_norms = np.log(w[keep]) - 0.5*dim*np.log(2*np.pi) - np.log(np.diagonal(chols, axis1 = 1, axis2 = 2)).sum(axis = 1)
+    return np.ascontiguousarray(means), inv_chols, log_norms
+
+@guvectorize(['void(float64[:], float64[:,:], float64[:,:,:], float64[:], float64[:])'], '(d),(k,d),(k,d,d),(k)->()', target = 'parallel', cache = True)
+def _gaussian_mixture_logpdf(x, means, inv_chols, log_norms, out):
+    """
+    Log-pdf of a Gaussian mixture, evaluated on all the samples at once.
+    
+    Arguments:
+        np.ndarray x:         sample, shape (dim,)
+        np.ndarray means:     component means, shape (n_components, dim)
+        np.ndarray inv_chols: inverse Cholesky factors of the covariances, shape (n_components, dim, dim)
+        np.ndarray log_norms: log-weights plus log-normalisation constants, shape (n_components,)
+        np.ndarray out:       log-pdf value
+    """
+    K, d = means.shape
+    m    = -np.inf
+    s    = 0.
+    for k in range(K):
+        # Squared Mahalanobis distance (inverse Cholesky factors are lower triangular)
+        r = 0.
+        for a in range(d):
+            t = 0.
+            for b in range(a + 1):
+                t += inv_chols[k, a, b]*(x[b] - means[k, b])
+            r += t*t
+        v = log_norms[k] - 0.5*r
+        # Running logsumexp
+        if v > m:
+            s = s*np.exp(m - v) + 1.
+            m = v
+        else:
+            s += np.exp(v - m)
+    out[0] = np.log(s) + m
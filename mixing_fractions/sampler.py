@@ -1,12 +1,12 @@
 import numpy as np
 
 from tqdm import tqdm
-from scipy.stats import dirichlet
 from pathlib import Path
+from multiprocessing import get_context
 
-from mixing_fractions.montecarlo import MC_integral
-from mixing_fractions.utils import _logsumexp_jit, summary_files
-from mixing_fractions.plot import single_model_histogram, single_event_histogram, joint_posterior_histogram
+from mixing_fractions.montecarlo import _mc_integral_batched
+from mixing_fractions.utils import _gibbs_step, _init_assignments, _run_chains, summary_files
+from mixing_fractions.plot import single_model_histogram, single_event_histogram, joint_posterior_histogram, _plot_task
 
 class Gibbs:
     """
@@ -14,7 +14,7 @@ class Gibbs:
     
     Arguments:
         iterable posterior_samples: GW posterior samples
-        iterable models:            formation channels models. Must be an iterable of callables
+        iterable models:            formation channels models. Each model must have a pdf() method or be a list of objects with a pdf() method (e.g. several draws for the same channel)
         iterable event_names:       GW event names
         iterable model_names:       formation channels names
         str out_folder:             output folder
@@ -60,61 +60,67 @@ class Gibbs:
             # Avoids issue with parallelisation
             except FileExistsError:
                 pass
+        # Models check
+        for model in self.models:
+            if not (hasattr(model, 'pdf') or (np.iterable(model) and len(model) > 0 and np.all([hasattr(pi, 'pdf') for pi in model]))):
+                raise Exception("models must have pdf method or be lists of objects with pdf method")
         # Initialisation
         self._evaluate_event_probabilities()
+        # Events with zero probability under every model cannot be assigned
+        unsupported = np.where(~np.isfinite(self.event_probabilities).any(axis = 1))[0]
+        if len(unsupported) > 0:
+            raise Exception("events not supported by any model: " + ", ".join([str(self.event_names[i]) for i in unsupported]))
+        # Contiguous (n_events, n_models) matrix and scratch buffer for the Gibbs steps
+        self._logp             = np.ascontiguousarray(self.event_probabilities, dtype = np.float32)
+        self._buf              = np.empty(self.n_models, dtype = np.float64)
 
     def _evaluate_event_probabilities(self):
         """
         Evaluate the probability for each event of being generated by each model
         """
-        self.event_probabilities = np.zeros((len(self.posterior_samples), len(self.models)))
-        for i, event in tqdm(enumerate(self.posterior_samples), total = len(self.posterior_samples), desc = 'Evaluating probabilities'):
-            self.event_probabilities[i] = np.array([MC_integral(model, event) for model in self.models])
+        all_samples              = np.concatenate(self.posterior_samples, axis = 0)
+        offsets                  = np.cumsum([0] + [len(event) for event in self.posterior_samples])
+        self.event_probabilities = _mc_integral_batched(self.models, all_samples, offsets, verbose = self.verbose).astype(np.float32)
 
-    def _draw_assignment(self, i):
+    def _draw_assignment(self, i, u):
         """
         Draw a category assignment for event i
         
         Arguments:
-            int i: index of the event
+            int i:    index of the event
+            double u: uniform random number in [0,1)
         
         Returns:
             idx: index of the selected component
         """
-        # Compute probability for categories
-        logP_DD    = np.log((self.counts + self.alpha)/(i + self.alpha0)) # Dirichlet Distribution
-        logP       = logP_DD + self.event_probabilities - _logsumexp_jit(self.event_probabilities[i], logP_DD)
-        # Draw assignment
-        idx        = np.random.choice(self.n_models, p = np.exp(logP))
-        return idx
+        return _gibbs_step(self._cpa, self._logp[i], i + self.alpha0, u, self._buf)
     
     def _initialise_assignments(self):
         """
         Initialise the assignments in a way that ensures immediate thermalisation
         """
-        self.z      = np.array([-1 for _ in self.posterior_samples])
-        self.counts = np.zeros(len(self.models))
-        order       = np.arange(self.n_events)
-        np.random.shuffle(order)
-        for i in order:
-            idx = self._draw_assignment(i)
-            self.z[i]         = idx
-            self.counts[idx] += 1.
+        order               = np.random.permutation(self.n_events)
+        self.z, self.counts = _init_assignments(self._logp, order, self.alpha, self.alpha0, np.random.random(self.n_events), self._buf)
+        # Counts plus concentration parameter, updated incrementally
+        self._cpa           = self.counts + self.alpha
     
-    def _update_component(self, i):
+    def _update_component(self, i, u):
         """
         Update the component to which event i is assigned to
 
         Arguments:
-            int i: index of the event
+            int i:    index of the event
+            double u: uniform random number in [0,1)
         """
         # Remove event from old component
-        old_idx               = self.assignments[i]
+        old_idx               = self.z[i]
         self.counts[old_idx] -= 1.
+        self._cpa[old_idx]   -= 1.
         # Draw new component
-        new_idx               = self._draw_assignment(i)
+        new_idx               = self._draw_assignment(i, u)
         self.z[i]             = new_idx
         self.counts[new_idx] += 1.
+        self._cpa[new_idx]   += 1.
     
     def _draw_mixing_fractions(self):
         """
@@ -123,24 +129,24 @@ class Gibbs:
         Returns:
             fractions: mixing fractions
         """
-        fractions = dirichlet((counts + self.alpha)/(self.n_events + self.alpha0)).rvs().flatten()
-        return fractions
+        return np.random.dirichlet(self._cpa/(self.n_events + self.alpha0))
     
     def _draw_sample(self):
         """
         Draw an uncorrelated sample for the mixing fractions
         """
-        event_indexes = np.random.choice(self.n_events, size = self.thinning, replace = True)
-        for idx in event_indexes:
-            self._update_component(idx)
+        event_indexes = np.random.randint(0, self.n_events, size = self.thinning)
+        uniforms      = np.random.random(self.thinning)
+        for idx, u in zip(event_indexes, uniforms):
+            self._update_component(idx, u)
         sample = self._draw_mixing_fractions()
         self.samples.append(sample)
         self.assignments.append(np.copy(self.z))
         return sample
     
     def initialise(self):
-        self.samples    = []
-        self.assgnments = []
+        self.samples     = []
+        self.assignments = []
         self._initialise_assignments()
     
     def rvs(self, n_draws = 1):
@@ -168,42 +174,74 @@ class Gibbs:
         """
         return np.array([self._draw_sample() for _ in tqdm(range(int(n_draws)), desc = 'Sampling', disable = ((n_draws < 2) or (self.verbose is False)))])
     
+    def rvs_chains(self, n_draws = 1, n_chains = 1, seeds = None):
+        """
+        Draw random samples from independent chains run in parallel
+        
+        Arguments:
+            int n_draws:    number of draws per chain
+            int n_chains:   number of chains
+            iterable seeds: random seed of each chain. If None, seeds are drawn from the NumPy global state
+        
+        Returns:
+            samples: samples for the mixing fractions, shape (n_chains, n_draws, n_models)
+        """
+        if seeds is None:
+            seeds = np.random.randint(0, 2**31 - 1, size = int(n_chains))
+        seeds = np.asarray(seeds, dtype = np.int64)
+        if not (len(seeds) == int(n_chains)):
+            raise IndexError('The number of seeds does not match the number of chains')
+        return _run_chains(self._logp, self.alpha, self.alpha0, self.thinning, int(n_draws), int(n_chains), seeds)
+    
     def make_summary(self):
         """
         Produce summary files
         """
-        if len(samples) > 0:
+        if len(self.samples) > 0:
             summary_files(self.samples, self.assignments, self.event_names, self.model_names, self.out_folder)
         else:
             print('Summary not available without samples')
     
-    def make_plots(self):
+    def make_plots(self, n_processes = None):
         """
         Produce plots
+        
+        Arguments:
+            int n_processes: number of processes used to produce the plots. If None, plots are produced serially.
+                             Workers are spawned, so the calling script must be guarded by if __name__ == '__main__'.
         """
-        if len(samples) > 0:
+        if len(self.samples) > 0:
+            fractions   = np.asarray(self.samples)
+            assignments = np.asarray(self.assignments)
             # Models
-            for model, samples in zip(self.model_names, self.samples.T):
-                single_model_histogram(samples, model, out_folder = self.out_folder)
+            tasks  = [(single_model_histogram, (samples, model), {'out_folder': self.out_folder}) for model, samples in zip(self.model_names, fractions.T)]
             # Events
-            for event, samples in zip(self.event_names, self.assignments.T):
-                single_event_histogram(samples, event, model_names = self.model_names, out_folder = self.out_folder)
+            tasks += [(single_event_histogram, (samples, event), {'model_names': self.model_names, 'out_folder': self.out_folder}) for event, samples in zip(self.event_names, assignments.T)]
             # Joint
-            joint_posterior_histogram(self.samples, model_names = self.model_names, out_folder = self.out_folder, colormap = self.colormap)
+            tasks += [(joint_posterior_histogram, (fractions,), {'model_names': self.model_names, 'out_folder': self.out_folder, 'colormap': self.colormap})]
+            if n_processes is None or int(n_processes) < 2:
+                for task in tasks:
+                    _plot_task(task)
+            else:
+                # Spawned rather than forked workers: numba's TBB threading layer is not fork-safe
+                with get_context('spawn').Pool(int(n_processes)) as pool:
+                    for _ in pool.imap_unordered(_plot_task, tasks):
+                        pass
         else:
             print('Summary not available without samples')
     
-    def run(self, n_draws = 1000):
+    def run(self, n_draws = 1000, n_processes = None):
         """
         Run the inference and produce plots
         
         Arguments:
-            int n_draws: number of draws
+            int n_draws:     number of draws
+            int n_processes: number of processes used to produce the plots (see make_plots)
         """
         self.initialise()
         self._rvs(n_draws)
         self.samples     = np.array(self.samples)
         self.assignments = np.array(self.assignments)
         self.make_summary()
-        self.make_plots()
+        self.make_plots(n_processes = n_processes)
         np.savetxt(Path(self.out_folder, 'posterior_samples.txt'), self.samples)
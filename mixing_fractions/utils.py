@@ -1,20 +1,118 @@
 import numpy as np
-from numba import njit
+from numba import njit, prange
 from figaro.load import load_data
 from pathlib import Path
 
-@njit
-def _logsumexp_jit(a, b):
-    a_max = np.max(a)
-    tmp = b * np.exp(a - a_max)
-    return np.log(np.sum(tmp)) + a_max
+# fastmath without the nnan/ninf flags: log-probabilities can be -inf
+_fastmath = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+
+@njit(cache = True, fastmath = _fastmath)
+def _gibbs_step(cpa, logp_row, i_plus_alpha0, u, buf):
+    """
+    Draw a category assignment combining the Dirichlet Distribution prior and the event probabilities.
+    
+    Arguments:
+        np.ndarray cpa:       number of events assigned to each component plus concentration parameter
+        np.ndarray logp_row:  log-probabilities of the event for each component
+        double i_plus_alpha0: normalisation of the Dirichlet Distribution
+        double u:             uniform random number in [0,1)
+        np.ndarray buf:       scratch buffer with the same length as cpa
+    
+    Returns:
+        int: index of the selected component
+    """
+    K   = cpa.shape[0]
+    inv = 1./i_plus_alpha0
+    m   = -np.inf
+    for k in range(K):
+        v      = np.log(cpa[k]*inv) + logp_row[k]
+        buf[k] = v
+        if v > m:
+            m = v
+    # Unnormalised cumulative distribution
+    s = 0.
+    for k in range(K):
+        s     += np.exp(buf[k] - m)
+        buf[k] = s
+    # Inverse CDF sampling
+    u *= s
+    for k in range(K):
+        if u < buf[k]:
+            return k
+    return K - 1
+
+@njit(cache = True)
+def _init_assignments(logp, order, alpha, alpha0, u, buf):
+    """
+    Sequentially assign the events to the components, following the given order
+    
+    Arguments:
+        np.ndarray logp:  log-probabilities of each event for each component, shape (n_events, n_models)
+        np.ndarray order: order in which the events are assigned
+        double alpha:     concentration parameter of each component
+        double alpha0:    concentration parameter
+        np.ndarray u:     uniform random numbers in [0,1), one per event
+        np.ndarray buf:   scratch buffer with length n_models
+    
+    Returns:
+        np.ndarray: assignments
+        np.ndarray: number of events assigned to each component
+    """
+    n_events, K = logp.shape
+    z           = np.full(n_events, -1, dtype = np.int32)
+    counts      = np.zeros(K)
+    cpa         = np.full(K, alpha)
+    for step in range(len(order)):
+        i            = order[step]
+        idx          = _gibbs_step(cpa, logp[i], i + alpha0, u[step], buf)
+        z[i]         = idx
+        counts[idx] += 1.
+        cpa[idx]    += 1.
+    return z, counts
+
+@njit(parallel = True, cache = True)
+def _run_chains(logp, alpha, alpha0, thinning, n_draws, n_chains, seeds):
+    """
+    Run independent Gibbs chains in parallel
+    
+    Arguments:
+        np.ndarray logp:  log-probabilities of each event for each component, shape (n_events, n_models)
+        double alpha:     concentration parameter of each component
+        double alpha0:    concentration parameter
+        int thinning:     number of steps between draws
+        int n_draws:      number of draws per chain
+        int n_chains:     number of chains
+        np.ndarray seeds: random seed of each chain
+    
+    Returns:
+        np.ndarray: mixing fraction samples, shape (n_chains, n_draws, n_models)
+    """
+    n_events, K = logp.shape
+    fractions   = np.empty((n_chains, n_draws, K))
+    for c in prange(n_chains):
+        np.random.seed(seeds[c])
+        buf       = np.empty(K)
+        # Initialisation
+        z, counts = _init_assignments(logp, np.random.permutation(n_events), alpha, alpha0, np.random.random(n_events), buf)
+        cpa       = counts + alpha
+        # Sampling
+        for d in range(n_draws):
+            for _ in range(thinning):
+                i            = np.random.randint(0, n_events)
+                cpa[z[i]]   -= 1.
+                idx          = _gibbs_step(cpa, logp[i], i + alpha0, np.random.random(), buf)
+                z[i]         = idx
+                cpa[idx]    += 1.
+            fractions[c, d] = np.random.dirichlet(cpa/(n_events + alpha0))
+    return fractions
 
 def summary_files(fractions, assignments, event_names, model_names, out_folder = '.'):
     """
     Produce summary files about the run
     
     Arguments:
-        np.ndarray samples:      samples produced by the run
+        np.ndarray fractions:    mixing fraction samples produced by the run
+        np.ndarray assignments:  event assignments produced by the run, shape (n_draws, n_events)
         list-of-str event_names: names of the GW events
         list-of-str model_names: names of the models
     """
@@ -25,12 +123,16 @@ def summary_files(fractions, assignments, event_names, model_names, out_folder =
         # Avoids issue with parallelisation
         except FileExistsError:
             pass
+    fractions = np.asarray(fractions)
     # Events
-    event_assignment = {event:{model: (assignments[i] == j).sum() for j, model in enumerate(model_names)} for i, event in enumerate(event_names)}
-    counts           = np.array([[name]+list(dv.values()) for (name,dv) in event_assignment.items()])
-    np.savetxt(Path(out_folder, 'summary_events.txt'), counts, fmt = '%s', header = 'event '+' '.join(model_names))
+    A        = np.asarray(assignments, dtype = np.int64).T # (n_events, n_draws)
+    n_events = len(event_names)
+    n_models = len(model_names)
+    idx      = A + n_models*np.arange(n_events)[:,None]
+    counts   = np.bincount(idx.ravel(), minlength = n_events*n_models).reshape(n_events, n_models)
+    np.savetxt(Path(out_folder, 'summary_events.txt'), np.column_stack((np.asarray(event_names, dtype = str), counts)), fmt = '%s', header = 'event '+' '.join(model_names))
     # Models
     with open(Path(out_folder, 'summary_models.txt'), 'w') as f:
-        for i, model in enumerate(event_names):
+        for i, model in enumerate(model_names):
             low, median, high = np.percentile(fractions[:,i], [16, 50, 84])
-            f.write('{0}: {1:.3f} + {2:.3f} - {3:.3f}'.format(model, median, high - median, median - low))
+            f.write('{0}: {1:.3f} + {2:.3f} - {3:.3f}\n'.format(model, median, high - median, median - low))
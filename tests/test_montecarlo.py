@@ -0,0 +1,73 @@
+import numpy as np
+from figaro.mixture import mixture
+
+from mixing_fractions.montecarlo import MC_integral, _is_gaussian_mixture, _pack_gaussian_mixture, _gaussian_mixture_logpdf, _mc_integral_batched
+
+def make_mixture(dim, w, probit = False, seed = 0):
+    rng   = np.random.default_rng(seed)
+    n_cl  = len(w)
+    means = rng.uniform(-2, 2, size = (n_cl, dim))
+    A     = rng.normal(size = (n_cl, dim, dim))*0.5
+    covs  = A @ A.transpose(0, 2, 1) + 0.1*np.eye(dim)
+    return mixture(means, covs, np.array(w), np.array([[-10., 10.]]*dim), dim, n_cl, 100, probit = probit)
+
+def test_gaussian_mixture_logpdf_1d():
+    mix = make_mixture(1, [0.3, 0.7])
+    x   = np.linspace(-5, 5, 101).reshape(-1, 1)
+    assert _is_gaussian_mixture(mix)
+    assert np.allclose(_gaussian_mixture_logpdf(x, *_pack_gaussian_mixture(mix)), mix.logpdf(x))
+
+def test_gaussian_mixture_logpdf_2d():
+    mix = make_mixture(2, [0.2, 0.5, 0.3], seed = 1)
+    x   = np.random.default_rng(2).normal(size = (200, 2))
+    assert np.allclose(_gaussian_mixture_logpdf(x, *_pack_gaussian_mixture(mix)), mix.logpdf(x))
+
+def test_gaussian_mixture_zero_weight():
+    mix = make_mixture(2, [0.4, 0., 0.6], seed = 3)
+    x   = np.random.default_rng(4).normal(size = (200, 2))
+    means, inv_chols, log_norms = _pack_gaussian_mixture(mix)
+    assert len(log_norms) == 2
+    assert np.allclose(_gaussian_mixture_logpdf(x, means, inv_chols, log_norms), np.log(mix.pdf(x)))
+
+def test_probit_mixture_not_packed():
+    assert not _is_gaussian_mixture(make_mixture(1, [1.], probit = True))
+
+def test_batched_gaussian_mixtures():
+    models  = [make_mixture(2, [0.2, 0.5, 0.3], seed = 5), make_mixture(2, [1.], seed = 6)]
+    rng     = np.random.default_rng(7)
+    events  = [rng.normal(size = (n, 2)) for n in [50, 70, 30]]
+    offsets = np.cumsum([0] + [len(e) for e in events])
+    log_I   = _mc_integral_batched(models, np.concatenate(events), offsets, verbose = False)
+    assert np.allclose(log_I, [[np.log(m.pdf(e).mean()) for m in models] for e in events])
+
+class StepDensity:
+    """
+    Density with no logpdf() method, vanishing for negative values
+    """
+    def pdf(self, x):
+        return np.where(x[:,0] > 0, 1., 0.)
+
+def test_log_mc_matches_mean_pdf():
+    models = [make_mixture(2, [0.2, 0.8], probit = True, seed = 8), make_mixture(2, [1.], seed = 9)]
+    x      = np.random.default_rng(10).normal(size = (100, 2))
+    assert np.isclose(MC_integral(models[0], x), np.log(models[0].pdf(x).mean()))
+    assert np.isclose(MC_integral(models, x), np.log(np.mean([m.pdf(x) for m in models])))
+
+def test_log_mc_zero_probability():
+    x = -np.ones((10, 1))
+    assert MC_integral(StepDensity(), x) == -np.inf
+
+def test_batched_segments_zero_probability():
+    events  = [-np.ones((5, 1)), np.ones((3, 1)), np.array([[-1.], [1.]])]
+    offsets = np.cumsum([0] + [len(e) for e in events])
+    log_I   = _mc_integral_batched([StepDensity()], np.concatenate(events), offsets, verbose = False)
+    assert np.array_equal(log_I[:,0], [-np.inf, 0., np.log(0.5)])
+
+def test_batched_list_of_draws():
+    draws   = [make_mixture(1, [1.], probit = True, seed = 11), make_mixture(1, [0.5, 0.5], seed = 12)]
+    rng     = np.random.default_rng(13)
+    events  = [rng.normal(size = (n, 1)) for n in [40, 60]]
+    offsets = np.cumsum([0] + [len(e) for e in events])
+    log_I   = _mc_integral_batched([draws, draws[0]], np.concatenate(events), offsets, verbose = False)
+    assert np.allclose(log_I[:,0], [np.log(np.mean([d.pdf(e) for d in draws])) for e in events])
+    assert np.allclose(log_I[:,1], [np.log(draws[0].pdf(e).mean()) for e in events])
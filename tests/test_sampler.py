@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+from figaro.mixture import mixture
+
+from mixing_fractions.sampler import Gibbs
+from mixing_fractions.montecarlo import MC_integral
+
+def test_event_probabilities_near_probit_bound(tmp_path):
+    bounds = np.array([[0., 1.]])
+    models = [mixture(np.array([[1.]]), np.array([[[0.5]]]), np.array([1.]), bounds, 1, 1, 100, probit = True),
+              mixture(np.array([[-1.]]), np.array([[[0.5]]]), np.array([1.]), bounds, 1, 1, 100, probit = True)]
+    events = [np.full((20, 1), 1.-1e-8), np.random.default_rng(0).uniform(0.2, 0.8, size = (20, 1))]
+    g      = Gibbs(events, models, ['A', 'B'], ['M1', 'M2'], out_folder = tmp_path, verbose = False, produce_output = False)
+    assert np.all(np.isfinite(g.event_probabilities))
+    assert np.allclose(g.event_probabilities, [[MC_integral(m, e) for m in models] for e in events], rtol = 1e-5)
+
+def test_unsupported_event_raises(tmp_path):
+    bounds = np.array([[-10., 10.]])
+    models = [mixture(np.array([[0.]]), np.array([[[1.]]]), np.array([1.]), bounds, 1, 1, 100)]
+    events = [np.zeros((10, 1)), np.full((10, 1), 1e3)]
+    with pytest.raises(Exception, match = 'not supported by any model: B$'):
+        Gibbs(events, models, ['A', 'B'], ['M1'], out_folder = tmp_path, verbose = False, produce_output = False)
+
+def test_empty_model_list_raises(tmp_path):
+    with pytest.raises(Exception, match = 'models must have pdf method'):
+        Gibbs([np.zeros((10, 1))], [[]], ['A'], ['M1'], out_folder = tmp_path, verbose = False, produce_output = False)
@@ -0,0 +1,52 @@
+import numpy as np
+from figaro.mixture import mixture
+
+from mixing_fractions.sampler import Gibbs
+from mixing_fractions.utils import _gibbs_step, _run_chains, summary_files
+
+def make_gibbs(tmp_path, thinning = 10):
+    bounds = np.array([[-10., 10.]])
+    models = [mixture(np.array([[mu]]), np.array([[[1.]]]), np.array([1.]), bounds, 1, 1, 100) for mu in [-1., 0., 1.]]
+    rng    = np.random.default_rng(0)
+    events = [rng.normal(rng.uniform(-1, 1), 0.5, size = (50, 1)) for _ in range(20)]
+    return Gibbs(events, models, ['E{}'.format(i) for i in range(20)], ['M1', 'M2', 'M3'], out_folder = tmp_path, thinning = thinning, verbose = False, produce_output = False)
+
+def test_gibbs_step_frequencies():
+    cpa      = np.array([2.3, 0.5, 4.1, 1.])
+    logp_row = np.array([-1., 0.5, -np.inf, -2.])
+    buf      = np.empty(len(cpa))
+    p        = np.exp(np.log(cpa) + logp_row)
+    p       /= p.sum()
+    # Evenly spaced uniforms: frequencies reproduce the inverse CDF up to 1/n
+    n        = 100000
+    u        = (np.arange(n) + 0.5)/n
+    idx      = np.array([_gibbs_step(cpa, logp_row, 7.9, ui, buf) for ui in u])
+    assert np.allclose(np.bincount(idx, minlength = len(cpa))/n, p, atol = 2./n)
+
+def test_run_chains_reproducible():
+    logp  = np.log(np.random.default_rng(1).uniform(size = (30, 3)))
+    seeds = np.array([1, 2, 3])
+    f1    = _run_chains(logp, 1./3., 1., 5, 20, 3, seeds)
+    f2    = _run_chains(logp, 1./3., 1., 5, 20, 3, seeds)
+    assert np.array_equal(f1, f2)
+    assert not np.array_equal(f1[0], f1[1])
+
+def test_cpa_matches_counts(tmp_path):
+    g = make_gibbs(tmp_path)
+    g.initialise()
+    for _ in range(5):
+        g._draw_sample()
+        assert np.allclose(g._cpa, g.counts + g.alpha, rtol = 0., atol = 1e-12)
+        assert np.array_equal(g.counts, np.bincount(g.z, minlength = g.n_models))
+
+def test_summary_files_counts(tmp_path):
+    rng         = np.random.default_rng(2)
+    n_draws     = 40
+    event_names = ['E0', 'E1', 'E2', 'E3']
+    model_names = ['M1', 'M2', 'M3']
+    assignments = [rng.integers(0, len(model_names), size = len(event_names)) for _ in range(n_draws)]
+    fractions   = [rng.dirichlet(np.ones(len(model_names))) for _ in range(n_draws)]
+    summary_files(fractions, assignments, event_names, model_names, out_folder = tmp_path)
+    counts = np.loadtxt(tmp_path / 'summary_events.txt', dtype = str)[:,1:].astype(float)
+    naive  = [[sum(a[i] == j for a in assignments) for j in range(len(model_names))] for i in range(len(event_names))]
+    assert np.array_equal(counts, naive)